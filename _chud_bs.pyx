@@ -0,0 +1,95 @@
+# cython: language_level=3
+# distutils: libraries = gmp
+#
+# Chudnovsky 二分拆分的叶子区间：直接调用 GMP，避免 Python 解释器逐项分派
+# 编译：cythonize -i _chud_bs.pyx（需要 Cython 和 libgmp 开发头文件）
+# 未编译时 compute_pi_mpmath.py 自动使用纯 Python 的 bs()
+
+cdef extern from "gmp.h":
+    ctypedef struct __mpz_struct:
+        pass
+    ctypedef __mpz_struct mpz_t[1]
+
+    void mpz_init(mpz_t x)
+    void mpz_init_set_ui(mpz_t rop, unsigned long op)
+    void mpz_clear(mpz_t x)
+    void mpz_set_ui(mpz_t rop, unsigned long op)
+    void mpz_add_ui(mpz_t rop, const mpz_t op1, unsigned long op2)
+    void mpz_mul(mpz_t rop, const mpz_t op1, const mpz_t op2)
+    void mpz_mul_ui(mpz_t rop, const mpz_t op1, unsigned long op2)
+    void mpz_addmul(mpz_t rop, const mpz_t op1, const mpz_t op2)
+    void mpz_submul(mpz_t rop, const mpz_t op1, const mpz_t op2)
+    void mpz_neg(mpz_t rop, const mpz_t op)
+    int mpz_sgn(const mpz_t op)
+    size_t mpz_sizeinbase(const mpz_t op, int base)
+    void *mpz_export(void *rop, size_t *countp, int order, size_t size,
+                     int endian, size_t nails, const mpz_t op)
+
+# 常量都拆成 32 位以内的乘数（Windows 上 unsigned long 只有 32 位）
+cdef unsigned long L = 13591409
+cdef unsigned long M = 545140134
+# 640320**3 // 24 = 26680 * 640320 * 640320
+cdef unsigned long C3_A = 26680
+cdef unsigned long C3_B = 640320
+
+# === mpz_t 转为 Python int（小端原始字节） ===
+cdef object mpz_to_int(const mpz_t z):
+    cdef size_t count = (mpz_sizeinbase(z, 2) + 7) // 8
+    cdef bytearray buf = bytearray(count)
+    mpz_export(<char *>buf, &count, -1, 1, 0, 0, z)
+    value = int.from_bytes(buf[:count], "little")
+    return -value if mpz_sgn(z) < 0 else value
+
+# === 逐项合并 [a, b) 的 (P, Q, T)，返回 Python int 三元组 ===
+# 每项的 p、q、L + M*j 先在小 mpz 中用 mpz_mul_ui 拼出，再与大数各做一次乘法
+# P 只保存绝对值，符号用 negative 记录：加到 T 上时选择 addmul / submul，最后再取反
+def bs_leaf(unsigned long a, unsigned long b):
+    cdef mpz_t P, Q, T, p, q, c
+    cdef unsigned long j
+    cdef bint negative = False
+    mpz_init_set_ui(P, 1)
+    mpz_init_set_ui(Q, 1)
+    mpz_init_set_ui(T, 0)
+    mpz_init(p)
+    mpz_init(q)
+    mpz_init(c)
+    try:
+        for j in range(a, b):
+            if j == 0:
+                # 第 0 项：p = q = 1，T += L
+                mpz_add_ui(T, T, L)
+                continue
+            # |p| = (6j-5)(2j-1)(6j-1)，每项 p 为负，累计符号翻转一次
+            mpz_set_ui(p, 6*j - 5)
+            mpz_mul_ui(p, p, 2*j - 1)
+            mpz_mul_ui(p, p, 6*j - 1)
+            negative = not negative
+            # q = j^3 * 640320^3 / 24
+            mpz_set_ui(q, j)
+            mpz_mul_ui(q, q, j)
+            mpz_mul_ui(q, q, j)
+            mpz_mul_ui(q, q, C3_A)
+            mpz_mul_ui(q, q, C3_B)
+            mpz_mul_ui(q, q, C3_B)
+            # c = L + M*j
+            mpz_set_ui(c, M)
+            mpz_mul_ui(c, c, j)
+            mpz_add_ui(c, c, L)
+            # (P, Q, T) <- (P*p, Q*q, T*q + P*p*c)
+            mpz_mul(P, P, p)
+            mpz_mul(Q, Q, q)
+            mpz_mul(T, T, q)
+            if negative:
+                mpz_submul(T, P, c)
+            else:
+                mpz_addmul(T, P, c)
+        if negative:
+            mpz_neg(P, P)
+        return mpz_to_int(P), mpz_to_int(Q), mpz_to_int(T)
+    finally:
+        mpz_clear(P)
+        mpz_clear(Q)
+        mpz_clear(T)
+        mpz_clear(p)
+        mpz_clear(q)
+        mpz_clear(c)
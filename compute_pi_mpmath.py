@@ -1,134 +1,364 @@
 import json
+import math
+from functools import cache
 import os
+import queue
+import signal
+import sys
+import threading
 import time
-import pickle
-from multiprocessing import Pool, cpu_count
-from mpmath import mp, mpf, sqrt
+from multiprocessing import cpu_count, get_context
 import logging
 
+# 优先使用 gmpy2（直接调用 GMP/MPFR），未安装时退回 mpmath
+try:
+    import gmpy2
+    from gmpy2 import mpz, mpfr, mul
+except ImportError:
+    gmpy2 = None
+    mpz = int
+    from operator import mul
+    from mpmath import mp, mpf, sqrt
+
+# 可选的 C/GMP 叶子实现（见 _chud_bs.pyx），未编译时使用纯 Python 递归
+try:
+    from _chud_bs import bs_leaf
+except ImportError:
+    bs_leaf = None
+
 logger = logging.getLogger()
-logger.setLevel(logging.INFO)
 
-formatter = logging.Formatter('[%(asctime)s] %(message)s', datefmt='%H:%M:%S')
+# === 日志配置：只在父进程中调用，spawn 出的子进程导入本模块时不再重复打开日志文件 ===
+def setup_logging():
+    logger.setLevel(logging.INFO)
+
+    formatter = logging.Formatter('[%(asctime)s] %(message)s', datefmt='%H:%M:%S')
 
-# 文件日志处理器
-file_handler = logging.FileHandler('out.log', encoding='utf-8')
-file_handler.setFormatter(formatter)
+    # 文件日志处理器
+    file_handler = logging.FileHandler('out.log', encoding='utf-8')
+    file_handler.setFormatter(formatter)
 
-# 终端日志处理器
-console_handler = logging.StreamHandler()
-console_handler.setFormatter(formatter)
+    # 终端日志处理器
+    console_handler = logging.StreamHandler()
+    console_handler.setFormatter(formatter)
 
-# 添加处理器
-logger.addHandler(file_handler)
-logger.addHandler(console_handler)
+    # 添加处理器
+    logger.addHandler(file_handler)
+    logger.addHandler(console_handler)
 
-logger.info("这条日志会同时打印到终端和写入文件")
+    logger.info("这条日志会同时打印到终端和写入文件")
 
 # === 配置参数 ===
-SAVE_INTERVAL_SECONDS = 300           # 保存周期（秒）
+SAVE_INTERVAL_SECONDS = 300           # 保存周期（秒）：打印预览并保存 (P, Q, T)
+FULL_SAVE_INTERVAL_SECONDS = 3600     # 完整精度 π 值文件的保存周期（秒），也可发送 SIGUSR1 立即触发
 PRECISION = 5_000_000                 # π 小数精度（位数）
-PROGRESS_FILE = "progress.json"       # 当前项数文件
-SUM_FILE = "pi_sum.pkl"               # 当前总和文件（pickle）
+PROGRESS_FILE = "progress.json"       # 当前项数文件（仅供查看，恢复时以 SUM_FILE 中的项数为准）
+SUM_FILE = "pi_pqt.bin"               # 断点文件（二进制）：项数 k 与 (P, Q, T) 三元组
 PI_VALUE_FILE = "pi_value.txt"        # 当前 π 值文件
 CORES = max(cpu_count() - 1, 1)       # 自动获取CPU核心数，至少1核
 TERMS_PER_BATCH = 900                 # 每轮计算总项数（必须能被CORES整除）
+WRITE_CHUNK_SIZE = 1 << 20            # 大文件分块写入大小（字节）
+
+# === 进程池启动方式 ===
+# Linux 上计算池用 fork：子进程直接继承父进程已导入的模块和常量（写时复制），不再重新导入
+# pi_pool 创建时父进程中已有计算池的管理线程，多线程进程里 fork 并不安全（Python 3.12+ 会给出警告），
+# 因此改用 forkserver，由一个干净的服务进程 fork 出子进程
+# macOS / Windows 保持默认的 spawn，子进程导入本模块时不做计算和日志初始化
+if sys.platform.startswith("linux"):
+    POOL_CONTEXT = get_context("fork")
+    PI_POOL_CONTEXT = get_context("forkserver")
+else:
+    POOL_CONTEXT = PI_POOL_CONTEXT = get_context()
 
 # 校验 batch 是否合适
 if TERMS_PER_BATCH % CORES != 0:
     raise ValueError("TERMS_PER_BATCH 必须能被 CORES 整除！")
 
-# 设置高精度
-mp.dps = PRECISION + 100
-
 # 常量
 L = 13591409
-X = 640320
-X3 = X ** 3
-C = 426880 * sqrt(mpf(10005))  # Chudnovsky 常量
-
-# === 使用递推计算 Chudnovsky 单项和区间和 ===
-def chudnovsky_term_recursive(start_k, end_k):
-    total = mpf(0)
-    a = mpf(1)
-
-    # 预热到 start_k 项
-    for i in range(start_k):
-        numerator = -(6*i + 1)*(2*i + 1)*(6*i + 5)
-        denominator = ((i + 1)**3) * X3
-        a *= mpf(numerator) / mpf(denominator)
-
-    # 正式开始累加
-    for i in range(start_k, end_k):
-        term = a * (L + 545140134 * i)
-        total += term
-        numerator = -(6*i + 1)*(2*i + 1)*(6*i + 5)
-        denominator = ((i + 1)**3) * X3
-        a *= mpf(numerator) / mpf(denominator)
-
-    return total
-
-# === 读取保存进度 ===
+M = 545140134
+C3_OVER_24 = 10939058860032000  # 640320**3 // 24，公式中的 24 已并入常量
+LEAF_SIZE = 64  # 区间不超过该长度时交给 C 叶子函数
+PI_BITS = int(PRECISION * math.log2(10)) + 200  # 最终结果的二进制精度
+# 每项约增加 log10(640320^3 / 1728) ≈ 14.18 位有效数字；超过该项数后再加项不会改变任何一位
+TERMS_NEEDED = math.ceil(PRECISION / math.log10(640320**3 / 1728))
+
+# === 完整精度只在 sqrt 和最终除法中局部启用，不修改全局精度 ===
+def full_precision():
+    if gmpy2 is not None:
+        return gmpy2.context(precision=PI_BITS)
+    return mp.workdps(PRECISION + 100)
+
+# === Chudnovsky 常量 C = 426880 * sqrt(10005) ===
+# 只有父进程在求 π 值时才需要；子进程只做整数二分拆分，不设置精度也不计算 C
+@cache
+def chudnovsky_constant():
+    with full_precision():
+        if gmpy2 is not None:
+            return 426880 * gmpy2.sqrt(mpfr(10005))
+        return 426880 * sqrt(mpf(10005))
+
+# === 二分拆分（binary splitting）：返回区间 [a, b) 的 (P, Q, T) 整数三元组 ===
+# 前 b 项之和 = T / Q，π = C * Q / T；全程只做整数（mpz）乘法，数位按需增长
+# 叶子上的 P、Q、T 都是小整数，保持为 Python int，不包装成 mpz
+def bs(a, b):
+    if bs_leaf is not None and b - a <= LEAF_SIZE:
+        return bs_leaf(a, b)
+    if b - a == 1:
+        if a == 0:
+            P = Q = 1
+        else:
+            P = -(6*a - 5) * (2*a - 1) * (6*a - 1)
+            Q = a * a * a * C3_OVER_24
+        return P, Q, P * (L + M * a)
+
+    m = (a + b) // 2
+    left = bs(a, m)
+    right = bs(m, b)
+    return merge(left, right)
+
+# === 合并相邻区间 [a, m) 与 [m, b) 的 (P, Q, T) ===
+# gmpy2.mul 总是返回 mpz，遇到机器字大小的 int 操作数时走 GMP 的 *_ui/*_si 快速路径
+def merge(left, right):
+    Pl, Ql, Tl = left
+    Pr, Qr, Tr = right
+    return mul(Pl, Pr), mul(Ql, Qr), mul(Tl, Qr) + mul(Pl, Tr)
+
+# === 两两平衡合并一组相邻区间的 (P, Q, T)，使每次乘法的两个操作数大小相近 ===
+def merge_all(parts):
+    while len(parts) > 1:
+        merged = [merge(parts[i], parts[i + 1]) for i in range(0, len(parts) - 1, 2)]
+        if len(parts) % 2:
+            merged.append(parts[-1])
+        parts = merged
+    return parts[0]
+
+# === 由 (P, Q, T) 得到 π 值（唯一的高精度除法） ===
+def pi_from_state(state):
+    _, Q, T = state
+    C = chudnovsky_constant()
+    with full_precision():
+        return C * Q / T
+
+# === 低精度预览 π：只取 Q、T 的高 256 位，用纯整数运算得到前 14 个字符 ===
+# 不碰 mpmath 的全局精度（mp 不是线程安全的，写盘线程可能正在用它做完整精度除法）
+def pi_preview(state):
+    _, Q, T = state
+    shift = max(T.bit_length() - 256, 0)
+    q, t = int(Q >> shift), int(T >> shift)
+    digits = 20
+    scaled = 426880 * math.isqrt(10005 * 10 ** (2 * digits)) * q // t  # ≈ π * 10**digits
+    return f"{scaled // 10 ** digits}.{scaled % 10 ** digits:0{digits}d}"[:14]
+
+# === π 值转为十进制数字（只转换一次），返回待写入的缓冲区列表 ===
+def pi_to_buffers(pi_val):
+    if gmpy2 is not None:
+        # 纯数字串，不含小数点；exp 为整数部分位数
+        digits, exp, _ = pi_val.digits(10, PRECISION + 1)
+        # 编码后立即释放 str，写盘期间内存中只保留一份数字
+        data = memoryview(digits.encode("ascii"))
+        del digits
+        return [data[:exp], b".", data[exp:]]
+    digits = mp.nstr(pi_val, PRECISION + 1)
+    data = memoryview(digits.encode("ascii"))
+    del digits
+    return [data]
+
+# === 将多个缓冲区按块写入 fd：有 writev 时一次系统调用提交多块 ===
+def write_buffers(fd, buffers):
+    chunks = [memoryview(buf)[i:i + WRITE_CHUNK_SIZE]
+              for buf in buffers for i in range(0, len(buf), WRITE_CHUNK_SIZE)]
+    i = 0
+    while i < len(chunks):
+        if hasattr(os, "writev"):
+            written = os.writev(fd, chunks[i:i + 1024])  # 不超过常见的 IOV_MAX
+        else:
+            written = os.write(fd, chunks[i])
+        # 跳过已写完的块，部分写入的块保留剩余部分
+        while written:
+            if written >= len(chunks[i]):
+                written -= len(chunks[i])
+                i += 1
+            else:
+                chunks[i] = chunks[i][written:]
+                written = 0
+
+# === 批量原子保存：先全部写入 *.tmp，再依次 rename 替换，缩短文件间不一致的窗口 ===
+# rename 前先 fsync，保证崩溃后替换进来的文件内容已经落盘，而不是空文件或半个文件
+def save_files(files):
+    for path, buffers in files.items():
+        fd = os.open(path + ".tmp", os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+        try:
+            write_buffers(fd, buffers)
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+    for path in files:
+        os.replace(path + ".tmp", path)
+
+# === 保存进度：断点、项数 ===
+# k 与 (P, Q, T) 写在同一个文件中一次性替换，两者不会错配；progress.json 只是方便查看
+def save_progress(k, state):
+    files = {}
+    files[SUM_FILE] = [CHECKPOINT_MAGIC, k.to_bytes(8, "big")] + pack_state(state)
+    files[PROGRESS_FILE] = [json.dumps({"k": k}).encode("utf-8")]
+    save_files(files)
+
+# === 在单独的子进程中保存完整精度的 π 值：除法和转十进制都在这里做 ===
+# gmpy2 / mpmath 做这两步时不释放 GIL，放在线程里会拖住主线程的合并计算
+def save_pi_value(Q, T):
+    save_files({PI_VALUE_FILE: pi_to_buffers(pi_from_state((1, Q, T)))})
+
+# === 断点文件格式：4 字节标识 + 8 字节大端项数 k + (P, Q, T) ===
+CHECKPOINT_MAGIC = b"PQT1"
+
+# === (P, Q, T) 二进制格式：每个整数为 4 字节大端长度 + 小端有符号原始字节 ===
+def pack_state(state):
+    buffers = []
+    for x in state:
+        x = int(x)
+        data = x.to_bytes((x.bit_length() + 8) // 8, "little", signed=True)
+        buffers.append(len(data).to_bytes(4, "big"))
+        buffers.append(data)
+    return buffers
+
+# 数据被截断或末尾有多余字节时抛出 ValueError
+def unpack_state(data):
+    data = memoryview(data)
+    state = []
+    offset = 0
+    for _ in range(3):
+        if offset + 4 > len(data):
+            raise ValueError("断点数据被截断")
+        length = int.from_bytes(data[offset:offset + 4], "big")
+        offset += 4
+        if offset + length > len(data):
+            raise ValueError("断点数据被截断")
+        state.append(mpz(int.from_bytes(data[offset:offset + length], "little", signed=True)))
+        offset += length
+    if offset != len(data):
+        raise ValueError("断点数据末尾有多余字节")
+    return tuple(state)
+
+# === 读取保存进度：项数和 (P, Q, T) 都从断点文件读取 ===
+# 格式不对或数据不完整时忽略断点，从头开始
 def get_saved_progress():
-    k = 0
-    total = mpf(0)
-    if os.path.exists(PROGRESS_FILE):
-        with open(PROGRESS_FILE, "r") as f:
-            k = json.load(f).get("k", 0)
-    if os.path.exists(SUM_FILE):
-        with open(SUM_FILE, "rb") as f:
-            total = pickle.load(f)
-    return k, total
-
-# === 计算单个批次 ===
-def compute_batch(start_k, batch_size):
-    return chudnovsky_term_recursive(start_k, start_k + batch_size)
+    empty = 0, (1, 1, 0)  # 空区间的 (P, Q, T)
+    if not os.path.exists(SUM_FILE):
+        return empty
+    with open(SUM_FILE, "rb") as f:
+        data = f.read()
+    if data[:4] != CHECKPOINT_MAGIC or len(data) < 12:
+        logger.info(f"⚠️ {SUM_FILE} 不是当前的断点格式，忽略并从头开始")
+        return empty
+    try:
+        state = unpack_state(memoryview(data)[12:])
+    except ValueError as e:
+        logger.info(f"⚠️ {SUM_FILE} 已损坏（{e}），忽略并从头开始")
+        return empty
+    return int.from_bytes(data[4:12], "big"), state
+
+# === 子进程忽略 SIGINT：Ctrl+C 只由父进程处理，再由父进程终止整个进程池 ===
+def init_worker():
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+# === 计算单个批次：子进程对 [start_k, end_k) 做完整的二分拆分子树 ===
+# 跨进程只返回普通 int 三元组（按需增长），而不是百万位精度的浮点部分和
+def compute_batch(start_k, end_k):
+    return tuple(int(x) for x in bs(start_k, end_k))
+
+# === imap_unordered 只接受单个参数，附带批次序号以便按序合并 ===
+def compute_batch_star(task):
+    index, start_k, end_k = task
+    return index, compute_batch(start_k, end_k)
+
+# === 收到 SIGUSR1 时，在下一轮结束后写出完整精度的 π 值 ===
+full_save_requested = False
+
+def request_full_save(signum, frame):
+    global full_save_requested
+    full_save_requested = True
+
+# === 后台写盘线程：主线程只提交 (k, (P, Q, T), 是否写 π 值) 快照，不等待写入完成 ===
+# 队列容量为 1：一份快照正在写入时最多再排队一份，磁盘慢也不会拖住计算
+# (P, Q, T) 每轮合并都会生成新对象，快照无需复制
+# 线程本身只做文件读写（释放 GIL）；完整精度的 π 值交给 pi_pool 的单个子进程计算，
+# 线程只是阻塞等待结果，与主线程的合并计算真正并行
+save_queue = queue.Queue(maxsize=1)
+
+def save_writer(pi_pool):
+    while True:
+        k, state, full = save_queue.get()
+        try:
+            save_progress(k, state)
+            if full:
+                _, Q, T = state
+                pi_pool.apply(save_pi_value, (Q, T))
+        except Exception:
+            logger.exception("❌ 保存进度失败")
+        finally:
+            save_queue.task_done()
 
 # === 主计算函数 ===
 def compute_pi():
-    k, total = get_saved_progress()
-    logger.info(f"▶ 从第 {k} 项开始，目标精度 {PRECISION} 位，使用 {CORES} 核心")
-    logger.info(f"🔄 已恢复进度：k = {k}，当前总和估值略大于 π ≈ {str(C / total)[:14] if k else '未知'}")
+    global full_save_requested
+    k, state = get_saved_progress()
+    logger.info(f"▶ 从第 {k} 项开始，目标精度 {PRECISION} 位（共需 {TERMS_NEEDED} 项），使用 {CORES} 核心")
+    logger.info(f"🔄 已恢复进度：k = {k}，当前总和估值略大于 π ≈ {pi_preview(state) if k else '未知'}")
 
-    last_save = time.time()
-    batch_size = TERMS_PER_BATCH // CORES
+    if hasattr(signal, "SIGUSR1"):
+        signal.signal(signal.SIGUSR1, request_full_save)
 
-    try:
-        with Pool(CORES) as pool:
-            while True:
-                batches = [(k + i * batch_size, batch_size) for i in range(CORES)]
-                results = pool.starmap(compute_batch, batches)
-                batch_sum = sum(results)
-                total += batch_sum
-                k += TERMS_PER_BATCH
+    last_save = last_full_save = time.time()
+    batch_size = TERMS_PER_BATCH // CORES
 
-                if time.time() - last_save >= SAVE_INTERVAL_SECONDS:
-                    pi_val = C / total
-                    pi_preview = str(pi_val)[:14]
+    # pi_pool 只有一个子进程，专门计算并写出完整精度的 π 值
+    with POOL_CONTEXT.Pool(CORES, initializer=init_worker) as pool, \
+            PI_POOL_CONTEXT.Pool(1, initializer=init_worker) as pi_pool:
+        # 写盘线程在两个进程池都创建之后再启动
+        threading.Thread(target=save_writer, args=(pi_pool,), daemon=True).start()
 
-                    logger.info(f"[{time.strftime('%H:%M:%S')}] 已计算 {k} 项，π ≈ {pi_preview}")
+        try:
+            while k < TERMS_NEEDED:
+                edges = [k + i * batch_size for i in range(CORES + 1)]
+                tasks = [(i, edges[i], edges[i + 1]) for i in range(CORES)]
+                results = [None] * CORES
+                for index, result in pool.imap_unordered(compute_batch_star, tasks, chunksize=1):
+                    results[index] = tuple(mpz(x) for x in result)
+                # (P, Q, T) 合并不满足交换律：本轮子树按区间顺序两两合并，再接到总状态之后
+                state = merge(state, merge_all(results))
+                k += TERMS_PER_BATCH
 
-                    # 保存 π 值（文本）
-                    with open(PI_VALUE_FILE, "w") as f:
-                        f.write(mp.nstr(pi_val, PRECISION))
+                # 已有快照在排队时跳过本次，等写盘线程取走后再提交
+                due = full_save_requested or time.time() - last_save >= SAVE_INTERVAL_SECONDS
+                if due and not save_queue.full():
+                    logger.info(f"[{time.strftime('%H:%M:%S')}] 已计算 {k} 项，π ≈ {pi_preview(state)}")
 
-                    # 保存进度
-                    with open(PROGRESS_FILE, "w") as f:
-                        json.dump({"k": k}, f)
+                    # 完整精度的除法和 π 值文件只在长周期或收到 SIGUSR1 时才做
+                    full = full_save_requested or time.time() - last_full_save >= FULL_SAVE_INTERVAL_SECONDS
+                    if full:
+                        full_save_requested = False
+                        last_full_save = time.time()
 
-                    # 保存总和
-                    with open(SUM_FILE, "wb") as f:
-                        pickle.dump(total, f)
+                    # 交给后台线程保存 (P, Q, T)、进度和 π 值（可选，在 pi_pool 中计算）
+                    save_queue.put_nowait((k, state, full))
 
                     last_save = time.time()
 
-    except KeyboardInterrupt:
-        logger.info("\n🛑 用户中断，正在保存最后进度...")
-        with open(PROGRESS_FILE, "w") as f:
-            json.dump({"k": k}, f)
-        with open(SUM_FILE, "wb") as f:
-            pickle.dump(total, f)
-        logger.info("✅ 已保存退出，建议稍后继续计算。")
+            # 已达到目标精度：(P, Q, T) 每轮都会变大，不再继续加项，保存断点和最终的 π 值后结束
+            save_queue.join()
+            save_progress(k, state)
+            _, Q, T = state
+            pi_pool.apply(save_pi_value, (Q, T))
+            logger.info(f"🎉 已计算 {k} 项，达到 {PRECISION} 位精度，π 值已写入 {PI_VALUE_FILE}")
+
+        # 在 with 内处理中断：进程池关闭前，先等后台线程（及 pi_pool 中的 π 值写出）完成
+        except KeyboardInterrupt:
+            logger.info("\n🛑 用户中断，正在保存最后进度...")
+            save_queue.join()  # 等待后台线程写完已提交的快照，避免与最后一次保存同时写文件
+            save_progress(k, state)
+            logger.info("✅ 已保存退出，建议稍后继续计算。")
 
 if __name__ == "__main__":
+    setup_logging()
     compute_pi()
@@ -1,89 +1,148 @@
 import json
 import os
+import sys
 import time
-from decimal import Decimal, getcontext
-from multiprocessing import Pool
+from decimal import Decimal, getcontext, localcontext
+from functools import cache
+from multiprocessing import get_context
 
 # === 配置参数 ===
-SAVE_INTERVAL_SECONDS = 30         # 每隔多少秒保存和打印一次
+SAVE_INTERVAL_SECONDS = 30         # 每隔多少秒保存断点和打印预览
+FULL_SAVE_INTERVAL_SECONDS = 600   # 完整精度 π 值文件的保存周期（秒）
 PRECISION = 1000000                # π 精度（小数点后位数）
-PROGRESS_FILE = "progress.json"    # 保存当前进度（第几项）
-SUM_FILE = "pi_sum.txt"            # 保存当前累加和（Chudnovsky总和）
+PROGRESS_FILE = "progress.json"    # 保存当前进度（第几项，仅供查看）
+STATE_FILE = "pi_state.json"       # 断点：项数 k、累加和、第 k 项的递推系数 a_k（三者一起原子替换）
+OLD_SUM_FILE = "pi_sum.txt"        # 旧版断点的累加和（与 PROGRESS_FILE 中的 k 配合），只在迁移时读取
 PI_VALUE_FILE = "pi_value.txt"     # ✅ 保存当前 π 值
 CORES = 3                          # 固定使用 3 个核心
 
-# 设置 decimal 精度环境
-getcontext().prec = PRECISION + 100  # 提高精度避免误差
-
-# π 的常数系数
-C = 426880 * Decimal(10005).sqrt()
-
-# === 单项计算（Chudnovsky 公式） ===
-def chudnovsky_term(k):
-    from math import factorial
-    k = Decimal(k)
-    numerator = Decimal((-1) ** int(k)) * factorial(6 * int(k)) * (13591409 + 545140134 * k)
-    denominator = factorial(3 * int(k)) * (factorial(int(k)) ** 3) * (640320 ** (3 * k))
-    return numerator / denominator
-
-# === 批量计算多个项 ===
-def compute_terms(start_k, end_k):
-    return sum(chudnovsky_term(k) for k in range(start_k, end_k))
-
-# === 读取保存的进度 ===
+# Linux 上用 fork 启动子进程，直接继承父进程的模块和 decimal 精度（写时复制）
+# macOS / Windows 保持默认的 spawn，由 Pool 的 initializer 设置精度
+POOL_CONTEXT = get_context("fork" if sys.platform.startswith("linux") else None)
+
+# 递推常量
+L = 13591409
+M = 545140134
+C3_OVER_24 = 10939058860032000  # 640320**3 // 24，公式中的 24 已并入常量
+
+# === Chudnovsky 递推比值：a_end / a_start = num / den（纯整数） ===
+def recurrence_ratio(start_k, end_k):
+    num, den = 1, 1
+    for i in range(start_k, end_k):
+        num *= (6*i + 1) * (2*i + 1) * (6*i + 5)
+        den *= (i + 1) * (i + 1) * (i + 1) * C3_OVER_24
+    # 每项比值为负，符号只取决于项数奇偶
+    if (end_k - start_k) & 1:
+        num = -num
+    return num, den
+
+# === 由 a_start 推出 a_end（父进程中用于确定每个区间的起始系数） ===
+def advance_a(a, start_k, end_k):
+    num, den = recurrence_ratio(start_k, end_k)
+    return a * num / den
+
+# === π 的常数系数（只在父进程保存时计算一次，子进程用不到） ===
+@cache
+def chudnovsky_constant():
+    return 426880 * Decimal(10005).sqrt()
+
+# === 低精度预览 π：累加和先舍入到 20 位再做除法，不做完整精度的 C / total ===
+def pi_preview(total):
+    with localcontext() as ctx:
+        ctx.prec = 20
+        return str(426880 * Decimal(10005).sqrt() / +total)[:14]
+
+# === 设置 decimal 精度环境（父进程调用一次，子进程通过 Pool 的 initializer 调用） ===
+def set_precision(precision):
+    getcontext().prec = precision + 100  # 提高精度避免误差
+
+# === 区间计算（递推：每项只需一次乘法和一次除法） ===
+def compute_terms(start_k, end_k, a_start):
+    total = Decimal(0)
+    a = a_start
+    for i in range(start_k, end_k):
+        total += a * (L + M * i)
+        # 分子、分母都是小整数，直接与 Decimal 运算，不再单独构造 Decimal 对象
+        a = a * -((6*i + 1) * (2*i + 1) * (6*i + 5)) / ((i + 1) * (i + 1) * (i + 1) * C3_OVER_24)
+    return total
+
+# === imap_unordered 只接受单个参数 ===
+def compute_terms_star(args):
+    return compute_terms(*args)
+
+# === 读取保存的进度：返回 (k, 累加和, a_k) ===
+# 只有旧版的 progress.json + pi_sum.txt 时从中迁移：a_k 为 None，由 compute_pi 设好精度后递推得到
 def get_saved_progress():
-    if os.path.exists(PROGRESS_FILE):
+    if os.path.exists(STATE_FILE):
+        with open(STATE_FILE, "r") as f:
+            state = json.load(f)
+        return state["k"], Decimal(state["total"]), Decimal(state["a"])
+    if os.path.exists(PROGRESS_FILE) and os.path.exists(OLD_SUM_FILE):
         with open(PROGRESS_FILE, "r") as f:
-            return json.load(f).get("k", 0)
-    return 0
+            k = json.load(f).get("k", 0)
+        with open(OLD_SUM_FILE, "r") as f:
+            total = Decimal(f.read().strip())
+        print(f"🔄 从旧版断点 {PROGRESS_FILE} + {OLD_SUM_FILE} 迁移进度（k = {k}）")
+        return k, total, None
+    return 0, Decimal(0), Decimal(1)
+
+# === 保存断点：先写临时文件再 os.replace，k、累加和、a_k 不会出现新旧混杂 ===
+def save_checkpoint(k, total, a):
+    with open(STATE_FILE + ".tmp", "w") as f:
+        json.dump({"k": k, "total": str(total), "a": str(a)}, f)
+        f.flush()
+        os.fsync(f.fileno())  # 内容落盘后再替换，崩溃后不会留下空的断点文件
+    os.replace(STATE_FILE + ".tmp", STATE_FILE)
+
+    # 保存当前项数（仅供查看）
+    with open(PROGRESS_FILE, "w") as f:
+        json.dump({"k": k}, f)
 
 # === 主计算函数 ===
-def compute_pi(start_k=0, terms_per_batch=10, cores=CORES):
+def compute_pi(start_k=0, total=Decimal(0), a=None, terms_per_batch=10, cores=CORES):
+    set_precision(PRECISION)
     k = start_k
-    total = Decimal(0)
-
-    # 恢复之前的总和（用于断点续算）
-    if os.path.exists(SUM_FILE):
-        with open(SUM_FILE, "r") as f:
-            total = Decimal(f.read().strip())
-
-    last_save = time.time()
 
-    while True:
-        # 准备任务批次
-        batches = [(k + i, k + i + 1) for i in range(terms_per_batch)]
+    # 没有保存的 a_k 时从第 0 项递推得到
+    if a is None:
+        a = advance_a(Decimal(1), 0, k)
 
-        # 多进程并行计算
-        with Pool(cores) as pool:
-            results = pool.starmap(compute_terms, batches)
-            batch_sum = sum(results)
-            total += batch_sum
+    last_save = last_full_save = time.time()
 
-        k += terms_per_batch
+    # 进程池只创建一次，整个计算过程复用
+    with POOL_CONTEXT.Pool(cores, initializer=set_precision, initargs=(PRECISION,)) as pool:
+        while True:
+            # 准备任务批次：每个核心负责一段连续区间，起始系数由父进程推出
+            edges = [k + terms_per_batch * i // cores for i in range(cores + 1)]
+            batches = []
+            for lo, hi in zip(edges[:-1], edges[1:]):
+                batches.append((lo, hi, a))
+                a = advance_a(a, lo, hi)
 
-        # 每隔 SAVE_INTERVAL_SECONDS 秒保存 & 打印
-        if time.time() - last_save >= SAVE_INTERVAL_SECONDS:
-            pi_val = C / total
+            # 多进程并行计算，部分和按完成顺序累加
+            for batch_sum in pool.imap_unordered(compute_terms_star, batches, chunksize=1):
+                total += batch_sum
 
-            # 控制台输出
-            print(f"[{time.strftime('%H:%M:%S')}] 已计算项数: {k}, 当前 π 值 (前 12 位): {str(pi_val)[:14]}")
+            k += terms_per_batch
 
-            # ✅ 保存 π 值到文件（每次覆盖）
-            with open(PI_VALUE_FILE, "w") as f:
-                f.write(str(pi_val))
+            # 每隔 SAVE_INTERVAL_SECONDS 秒保存 & 打印
+            if time.time() - last_save >= SAVE_INTERVAL_SECONDS:
+                # 控制台输出
+                print(f"[{time.strftime('%H:%M:%S')}] 已计算项数: {k}, 当前 π 值 (前 12 位): {pi_preview(total)}")
 
-            # 保存当前项数
-            with open(PROGRESS_FILE, "w") as f:
-                json.dump({"k": k}, f)
+                # ✅ 完整精度的除法和 π 值文件只在长周期才做（每次覆盖）
+                if time.time() - last_full_save >= FULL_SAVE_INTERVAL_SECONDS:
+                    with open(PI_VALUE_FILE, "w") as f:
+                        f.write(str(chudnovsky_constant() / total))
+                    last_full_save = time.time()
 
-            # 保存累加和
-            with open(SUM_FILE, "w") as f:
-                f.write(str(total))
+                # 保存项数、累加和与递推系数
+                save_checkpoint(k, total, a)
 
-            last_save = time.time()
+                last_save = time.time()
 
 # === 启动入口 ===
 if __name__ == "__main__":
-    start_k = get_saved_progress()
+    start_k, total, a = get_saved_progress()
     print(f"▶ 从第 {start_k} 项继续计算 π，使用 {CORES} 核心...")
-    compute_pi(start_k=start_k)
+    compute_pi(start_k=start_k, total=total, a=a)